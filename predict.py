@@ -1,29 +1,72 @@
-import pandas as pd, numpy as np, json, joblib
+import pandas as pd, json, joblib, csv
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from functools import lru_cache
 from catboost import Pool
 
-model = joblib.load("model.pkl")
-features = json.load(open("features.json"))
+# артефакты загружаются один раз на процесс: повторные вызовы main()
+# (сервис, цикл) не распаковывают модель заново
+@lru_cache(maxsize=1)
+def _get_model():
+    return joblib.load("model.pkl")
 
-X = pd.read_csv("test.csv")
-X = X.reindex(columns=features)
+@lru_cache(maxsize=1)
+def _get_features():
+    with open("features.json", "r") as f:
+        return tuple(json.load(f))
 
-cat_cols = [c for c in ["cat_id", "gender"] if c in X.columns]
-num_cols = [c for c in X.columns if c not in cat_cols]
+@lru_cache(maxsize=1)
+def _get_predict_fn():
+    # ветку выбираем один раз по загруженной модели; astype без копии, если уже float
+    model = _get_model()
+    if hasattr(model, "predict_proba"):
+        return lambda pool: model.predict_proba(pool)[:, 1]
+    return lambda pool: model.predict(pool).astype(float, copy=False)
 
-for c in cat_cols:
-    X[c] = X[c].astype("string").fillna("na")
+def _impute_numeric(tbl, num_cols):
+    # приведение к float32, медиана (T-digest, один проход) и заполнение пропусков —
+    # ядрами Arrow по всей таблице, без промежуточных pandas Series
+    for c in num_cols:
+        if c not in tbl.column_names:
+            tbl = tbl.append_column(c, pa.nulls(tbl.num_rows, pa.float32()))
+            continue
+        col = tbl[c]
+        if pa.types.is_string(col.type) or pa.types.is_large_string(col.type):
+            # строки приводим как pd.to_numeric(errors="coerce"): мусор ("na" и т.п.) -> null,
+            # pc.cast на таком значении бросил бы исключение
+            col = pa.array(pd.to_numeric(col.to_pandas(), errors="coerce").astype("float32"), from_pandas=True)
+        else:
+            col = pc.cast(col, pa.float32())
+        col = pc.fill_null(col, pc.approximate_median(col))
+        tbl = tbl.set_column(tbl.schema.get_field_index(c), c, col)
+    return tbl
 
-for c in num_cols:
-    X[c] = pd.to_numeric(X[c], errors="coerce")
-    med = float(X[c].median())
-    X[c] = X[c].fillna(med)
+def main():
+    features = list(_get_features())
 
-pool = Pool(X, cat_features=cat_cols)
-if hasattr(model, "predict_proba"):
-    proba = model.predict_proba(pool)[:, 1]
-else:
-    proba = model.predict(pool).astype(float)
+    cat_cols = [c for c in ["cat_id", "gender"] if c in features]
+    num_cols = [c for c in features if c not in cat_cols]
 
-X["prediction"] = proba
-X[["prediction"]].to_csv("submission.csv", index=False)
-print("Предсказания сохранены в submission.csv")
+    # CatBoost всё равно хранит числовые признаки во float32 — приводим сразу
+    tbl = _impute_numeric(pq.read_table("/app/work/processed.parquet"), num_cols)
+    # self_destruct: буферы Arrow освобождаются по ходу конвертации, память не удваивается
+    X = tbl.to_pandas(split_blocks=True, self_destruct=True)
+    del tbl
+    X = X.reindex(columns=features)
+
+    for c in cat_cols:
+        X[c] = X[c].astype("string").fillna("na")
+
+    pool = Pool(X, cat_features=cat_cols)
+    proba = _get_predict_fn()(pool)
+
+    # одна колонка — пишем прямо из массива, без временного DataFrame и форматтера pandas
+    with open("submission.csv", "w", newline="") as f:
+        w = csv.writer(f, lineterminator="\n")
+        w.writerow(["prediction"])
+        w.writerows(zip(proba.tolist()))
+    print("Предсказания сохранены в submission.csv")
+
+if __name__ == "__main__":
+    main()
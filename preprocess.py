@@ -1,52 +1,149 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import json
+import re
 from pathlib import Path
 
+# строки храним в Arrow: str.replace/strip/lower у такого dtype выполняются
+# C++-ядрами pyarrow.compute (re2), без вызова Python на каждую строку.
+# В re2 \w, \d и \s только ASCII, поэтому буквы, цифры и пробелы задаём Unicode-классами,
+# как у Python-регулярок при обучении (WS_CLASS == множество str.isspace)
+STR_DTYPE = "string[pyarrow]"
+WS_CLASS = r"\s\p{Z}\x0b\x1c-\x1f\x85"
+WS_RE = "[" + WS_CLASS + "]+"
+PUNCT_RE = r"[^\p{L}\p{N}_" + WS_CLASS + r"\-.,/&()]"
+FRAUD_PREFIX_RE = "^[" + WS_CLASS + r"]*fraud[_\-" + WS_CLASS + "]+"
+NON_DIGIT_RE = r"[^\p{Nd}]"
+
+TEXT_COLS = ["cat_id", "name_1", "name_2", "gender", "street", "one_city", "us_state"]
+# размер блока потокового чтения CSV, байт
+BLOCK_SIZE = 64 << 20
+
+def _lower(s):
+    # utf8_lower — простое отображение регистра, str.lower — полное: "\u0130" -> "i\u0307";
+    # это единственный такой символ, подставляем его сами. Не совпадает только финальная
+    # сигма: Python в конце слова даёт "ς", Arrow всегда "σ"
+    return s.str.replace("\u0130", "i\u0307", regex=False).str.lower()
+
 def clean_text_series(s):
-    s = s.astype("string")
-    s = s.str.replace(r"\s+", " ", regex=True).str.strip()
-    s = s.str.replace(r"[^\w\s\-\.\,\/\&\(\)]", "", regex=True)
-    s = s.str.lower()
+    s = s.astype(STR_DTYPE)
+    s = s.str.replace(WS_RE, " ", regex=True).str.strip()
+    s = s.str.replace(PUNCT_RE, "", regex=True)
+    s = _lower(s)
     return s.fillna("na")
 
 def strip_fraud_prefix(s):
-    s = s.astype("string").fillna("na")
-    s = s.str.replace(r"^\s*fraud[_\-\s]+", "", regex=True)
-    s = s.str.replace(r"\s+", " ", regex=True).str.strip()
-    s = s.str.replace(r"[^\w\s\-\.\,\/\&\(\)]", "", regex=True)
-    s = s.str.lower()
+    s = s.astype(STR_DTYPE).fillna("na")
+    s = s.str.replace(FRAUD_PREFIX_RE, "", regex=True)
+    s = s.str.replace(WS_RE, " ", regex=True).str.strip()
+    s = s.str.replace(PUNCT_RE, "", regex=True)
+    s = _lower(s)
     return s.replace("", "na")
 
 def pad_zip(s):
-    s = s.astype("string").fillna("na")
-    s = s.str.replace(r"[^\d]", "", regex=True).str.slice(0, 9)
+    s = s.astype(STR_DTYPE).fillna("na")
+    # почти все индексы уже из одних цифр (utf8_is_digit) — регулярку гоняем только по остальным
+    bad = ~s.str.isdigit()
+    if bad.any():
+        s[bad] = s[bad].str.replace(NON_DIGIT_RE, "", regex=True)
+    s = s.str.slice(0, 9)
     return s.replace("", "na")
 
-def _hav_km(a_lat, a_lon, b_lat, b_lon):
-    lat1 = np.radians(a_lat.astype(float))
-    lon1 = np.radians(a_lon.astype(float))
-    lat2 = np.radians(b_lat.astype(float))
-    lon2 = np.radians(b_lon.astype(float))
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    h = np.sin(dlat/2.0)**2 + np.cos(lat1)*np.cos(lat2)*np.sin(dlon/2.0)**2
-    return 2.0 * 6371.0 * np.arcsin(np.sqrt(h))
+# эталон — очистка Python-регулярками, как при обучении
+def _py_clean_text(x):
+    x = re.sub(r"\s+", " ", x).strip()
+    x = re.sub(r"[^\w\s\-\.\,\/\&\(\)]", "", x)
+    return x.lower()
 
-def main():
-    input_path = Path("/app/input/test.csv")
-    output_path = Path("/app/work/prepared.csv")
+def _py_strip_fraud_prefix(x):
+    x = re.sub(r"^\s*fraud[_\-\s]+", "", x)
+    return _py_clean_text(x) or "na"
 
-    # === загружаем сохранённые артефакты с обучения ===
-    with open("medians.json", "r") as f:
-        medians = json.load(f)
-    with open("rare_maps.json", "r") as f:
-        rare_maps = json.load(f)
+def _py_pad_zip(x):
+    return re.sub(r"[^\d]", "", x)[:9] or "na"
+
+# строки, на которых Arrow-путь расходился бы с Python без Unicode-классов
+PARITY_SAMPLES = [
+    "Main\xa0St", "Café  Zoë!", "a\u2003b\u3000c", "x\x0by\x1cz\x85w", "\u0130stanbul",
+    "fraud_\xa0Kub, Inc.", "\u2003fraud-Bins & Co (NY)/#1 ", "١٢٣45-6789", "",
+]
+
+def _check_parity():
+    # дешёвая проверка на старте: Arrow-очистка обязана давать те же категории, что при обучении
+    s = pd.Series(PARITY_SAMPLES)
+    for arrow_fn, py_fn in [(clean_text_series, _py_clean_text),
+                            (strip_fraud_prefix, _py_strip_fraud_prefix),
+                            (pad_zip, _py_pad_zip)]:
+        got = arrow_fn(s).tolist()
+        want = [py_fn(x) for x in PARITY_SAMPLES]
+        if got != want:
+            raise RuntimeError(f"{arrow_fn.__name__}: Arrow-очистка расходится с Python: {got!r} != {want!r}")
+
+# исходные колонки, из которых строятся производные признаки
+DERIVED_SOURCES = {
+    "hour": ["transaction_time"],
+    "dow": ["transaction_time"],
+    "is_weekend": ["transaction_time"],
+    "dist_km": ["lat", "lon", "merchant_lat", "merchant_lon"],
+}
+
+def _needed_columns(features):
+    cols = []
+    for f in features:
+        for c in DERIVED_SOURCES.get(f, [f]):
+            if c not in cols:
+                cols.append(c)
+    return cols
+
+def _hav_km(coords):
+    # coords: float64 (N, 4) — lat, lon, merchant_lat, merchant_lon в градусах;
+    # переводим в радианы одним проходом, строки результата непрерывны в памяти
+    lat1, lon1, lat2, lon2 = np.radians(coords.T, order="C")
+    # дальше считаем на месте в этих же четырёх строках, без временных массивов
+    lon2 -= lon1                            # dlon
+    np.cos(lat1, out=lon1)                  # cos(lat1)
+    np.subtract(lat2, lat1, out=lat1)       # dlat
+    np.cos(lat2, out=lat2)                  # cos(lat2)
+    lon1 *= lat2
+    lon2 *= 0.5
+    np.sin(lon2, out=lon2)
+    np.square(lon2, out=lon2)
+    lon1 *= lon2                            # cos(lat1)*cos(lat2)*sin(dlon/2)**2
+    lat1 *= 0.5
+    np.sin(lat1, out=lat1)
+    np.square(lat1, out=lat1)
+    lat1 += lon1                            # h
+    np.sqrt(lat1, out=lat1)
+    np.arcsin(lat1, out=lat1)
+    lat1 *= 2.0 * 6371.0
+    return lat1
+
+NS_PER_HOUR = 3_600_000_000_000
 
-    df = pd.read_csv(input_path)
+def _time_features(dt):
+    # час, день недели и выходной считаем арифметикой над int64-наносекундами
+    # вместо отдельного прохода .dt-аксессора на каждый признак
+    arr = dt.to_numpy(dtype="datetime64[ns]")
+    nat = np.isnat(arr)
+    hours = arr.view("i8") // NS_PER_HOUR
+    hour = hours % 24
+    dow = (hours // 24 + 3) % 7             # 1970-01-01 — четверг, понедельник = 0
+    hour[nat] = -1
+    dow[nat] = -1
+    return hour, dow, (dow >= 5).astype(np.int64)
+
+def preprocess(df, medians, rare_maps, schema_cfg):
+    # все колонки приходят строками; заведомо числовые (с медианой с обучения и координаты)
+    # приводим с coerce: мусор -> NaN, а не падение всего прогона. float64 всегда, чтобы
+    # схема не зависела от содержимого блока. Прочие колонки остаются текстом, как были
+    raw_num = [c for c in dict.fromkeys(list(medians) + DERIVED_SOURCES["dist_km"]) if c in df.columns]
+    df[raw_num] = df[raw_num].apply(pd.to_numeric, errors="coerce").astype(np.float64)
 
     # очистка текстов
-    for col in ["cat_id", "name_1", "name_2", "gender", "street", "one_city", "us_state"]:
+    for col in TEXT_COLS:
         if col in df.columns:
             df[col] = clean_text_series(df[col])
     if "merch" in df.columns:
@@ -56,31 +153,95 @@ def main():
 
     # временные признаки
     if "transaction_time" in df.columns:
-        dt = pd.to_datetime(df["transaction_time"], errors="coerce", infer_datetime_format=True)
-        df["hour"] = dt.dt.hour.fillna(-1).astype(int)
-        df["dow"] = dt.dt.dayofweek.fillna(-1).astype(int)
-        df["is_weekend"] = (df["dow"] >= 5).astype(int)
+        # формат известен с обучения: разбор идёт только быстрым C-путём, без угадывания;
+        # cache=True разбирает каждое повторяющееся значение один раз
+        dt = pd.to_datetime(df["transaction_time"], format=schema_cfg["ts_fmt"], errors="coerce", cache=True)
+        # строгий формат молча дал бы NaT (hour=dow=-1) на всём блоке, если формат входа другой
+        if dt.isna().all() and df["transaction_time"].notna().any():
+            raise ValueError(
+                f"transaction_time не разбирается форматом {schema_cfg['ts_fmt']!r} из schema.json, "
+                f"пример значения: {df['transaction_time'].dropna().iloc[0]!r}"
+            )
+        df["hour"], df["dow"], df["is_weekend"] = _time_features(dt)
 
     # гео-расстояние
-    if all(x in df.columns for x in ["lat", "lon", "merchant_lat", "merchant_lon"]):
-        df["dist_km"] = _hav_km(df["lat"], df["lon"], df["merchant_lat"], df["merchant_lon"])
+    geo_cols = DERIVED_SOURCES["dist_km"]
+    if all(x in df.columns for x in geo_cols):
+        df["dist_km"] = _hav_km(df[geo_cols].to_numpy(dtype=np.float64))
 
     # заполняем пропуски медианами
-    for c, med in medians.items():
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(med)
+    num_cols = [c for c in medians if c in df.columns]
+    df[num_cols] = df[num_cols].fillna(medians)
 
     # rare mapping категориальных
     for c, mapping in rare_maps.items():
         if c in df.columns:
-            df[c] = df[c].astype("string").fillna("na").map(lambda x: mapping.get(x, "rare")).astype("string")
+            # dict в map — одна хеш-выборка на строку без Python-лямбды
+            df[c] = df[c].astype(STR_DTYPE).fillna("na").map(mapping).fillna("rare").astype(STR_DTYPE)
+
+    return df
+
+def _to_table(df, features, schema=None):
+    # выбираем только нужные фичи прямо при конвертации в Arrow, без копии через df[cols]
+    if schema is not None:
+        return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    return pa.Table.from_pandas(df, columns=[c for c in features if c in df.columns], preserve_index=False)
 
-    # выбираем только нужные фичи
+def main():
+    input_path = Path("/app/input/test.csv")
+    output_path = Path("/app/work/processed.parquet")
+
+    # === загружаем сохранённые артефакты с обучения ===
+    with open("medians.json", "r") as f:
+        medians = json.load(f)
+    with open("rare_maps.json", "r") as f:
+        rare_maps = json.load(f)
     with open("features.json", "r") as f:
         features = json.load(f)
-    df = df[[c for c in features if c in df.columns]]
+    with open("schema.json", "r") as f:
+        schema_cfg = json.load(f)
+    _check_parity()
+
+    # читаем только колонки, нужные для итоговых фич: остальные не парсим и не чистим
+    needed = _needed_columns(features)
+    header = pd.read_csv(input_path, nrows=0).columns
+    usecols = [c for c in header if c in needed]
+
+    # читаем и пишем потоково блоками: пиковая память ~ размер блока, а не всего файла.
+    # медианы и rare-маппинги заданы с обучения, поэтому блоки обрабатываются независимо
+    reader = pacsv.open_csv(
+        input_path,
+        read_options=pacsv.ReadOptions(block_size=BLOCK_SIZE),
+        # все колонки читаем строками: потоковый ридер иначе выводит типы по первому блоку,
+        # и значение в позднем блоке может уронить чтение; пустые и "NA"-подобные — null, как в pandas
+        convert_options=pacsv.ConvertOptions(
+            include_columns=usecols,
+            column_types=dict.fromkeys(usecols, pa.string()),
+            strings_can_be_null=True,
+        ),
+    )
+    writer = None
+    schema = None
+    try:
+        for batch in reader:
+            # split_blocks: колонки не склеиваются в 2D-блоки при конвертации
+            df = preprocess(batch.to_pandas(split_blocks=True), medians, rare_maps, schema_cfg)
+            # схема фиксируется по первому блоку, остальные приводятся к ней
+            table = _to_table(df, features, schema)
+            if writer is None:
+                schema = table.schema
+                # Parquet вместо CSV: predict.py читает готовые типы без разбора текста
+                writer = pq.ParquetWriter(output_path, schema, compression="zstd")
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        # пустой вход — пишем файл только со схемой
+        df = preprocess(reader.schema.empty_table().to_pandas(), medians, rare_maps, schema_cfg)
+        pq.write_table(_to_table(df, features), output_path, compression="zstd")
 
-    df.to_csv(output_path, index=False)
     print(f"[1/3] Preprocessing done — saved {output_path}")
 
 if __name__ == "__main__":
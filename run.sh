@@ -7,10 +7,10 @@
 
 set -euo pipefail
 
-# Run preprocessing (writes to ./work/processed.csv)
+# Run preprocessing (writes to ./work/processed.parquet)
 python3 preprocess.py
 
-# Run prediction (reads from ./work/processed.csv and writes outputs)
+# Run prediction (reads from ./work/processed.parquet and writes outputs)
 python3 predict.py
 
 echo "Inference pipeline completed successfully."
\ No newline at end of file